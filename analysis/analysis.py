@@ -4,119 +4,274 @@
 # 2. Runs 4-sensor ML anomaly detection
 # 3. Maps verified attacks
 
+import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # Figures are only saved to PNG; skip loading a GUI toolkit
 import matplotlib.pyplot as plt
 import os
+import sys
 import hashlib
+import joblib
+import sklearn
 from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
 
 LOG_FILE = 'forensic_log_v4.csv'
 # NEW Features to analyze
 FEATURES = ['pressure_delta', 'vibration_mag', 'audio_level', 'dust_voltage']
+# printf format of each column in the attack report
+COLUMN_FORMATS = {'lat': '%.6f', 'lon': '%.6f', 'pressure_delta': '%.2f', 'vibration_mag': '%.2f',
+                  'audio_level': '%d', 'dust_voltage': '%.3f'}
+# Expected fraction of anomalous samples
+CONTAMINATION = 0.001
+# Each link is SHA-256 truncated to 128 bits (must match the firmware's HASH_BYTES)
+HASH_BYTES = 16
+GENESIS_HASH = "0" * (2 * HASH_BYTES)
+# Column order of each log line (must match the firmware's log line)
+LOG_COLUMNS = ['timestamp', 'pressure_delta', 'vibration_mag_sq', 'audio_level', 'dust_raw',
+               'lat', 'lon', 'alt', 'prev_hash']
+# Declared column types (skips read_csv's type inference). The float32 columns
+# are logged with at most 2 decimals, well within float32 round-trip precision.
+# vibration_mag_sq is a sum of three squared int16 readings (can exceed int32).
+LOG_DTYPES = {'timestamp': np.int64, 'pressure_delta': np.float32, 'vibration_mag_sq': np.int64,
+              'audio_level': np.int16, 'dust_raw': np.uint16, 'lat': np.float64, 'lon': np.float64,
+              'alt': np.float32, 'prev_hash': 'string'}
+# Columns kept in memory for analysis once a chunk is verified
+ANALYSIS_COLUMNS = ['lat', 'lon', 'pressure_delta', 'vibration_mag_sq', 'audio_level', 'dust_raw']
+# The firmware logs the dust sensor's raw 16-bit ADC count (3.3V reference)
+DUST_VOLTS_PER_COUNT = 3.3 / 65535
+# Opt-in cache of trained models, keyed on the log's final chain hash. joblib.load
+# unpickles (i.e. runs) whatever it finds there, so only point this at a directory
+# nobody else can write to.
+MODEL_CACHE_DIR = os.environ.get('UFW_MODEL_CACHE')
+# Rows read (and verified) per chunk
+CHUNK_ROWS = 1_000_000
 
+# Reused by every attack map (see get_map_axes)
+_map_fig, _map_ax = None, None
 
-def verify_hash_chain(df):
-    """Verifies the SHA-256 hash chain. Returns True if valid."""
+
+def chain_digest(line):
+    """The hash the next log line stores for this one."""
+    return hashlib.sha256(line).digest()[:HASH_BYTES]
+
+
+def find_broken_link(lines, next_digests):
+    """Checks lines[i] hashes to next_digests[i] for every i. Returns the first failing i, or None."""
+    # Serial on purpose: hashing is the cheap part of verification (parsing and
+    # rebuilding the lines dominate), so shipping lines to worker processes
+    # costs more than it saves
+    sha256 = hashlib.sha256
+    for i, (line, digest) in enumerate(zip(lines, next_digests)):
+        # Each line's hash must match the hash stored in the next line
+        if sha256(line).digest()[:HASH_BYTES] != digest:
+            return i
+    return None
+
+
+def read_log(path):
+    """Yields the log as CHUNK_ROWS-row DataFrames.
+    Parse errors (including an empty file) surface while iterating."""
+    with pd.read_csv(path, chunksize=CHUNK_ROWS, dtype=LOG_DTYPES, engine='c') as reader:
+        yield from reader
+
+
+def verify_hash_chain(chunks):
+    """Verifies the SHA-256 hash chain over an iterable of log chunks.
+    Returns the verified ANALYSIS_COLUMNS as one DataFrame, or None if invalid."""
     print("\n--- FORENSIC VERIFICATION ---")
     is_valid = True
+    verified = []
+    first_row = 0  # Row number of the chunk's first line
+    last_line = None  # Last line of the previous chunk, carried across the boundary
 
-    # Check genesis block
-    if df.iloc[0]['prev_hash'] != "0" * 64:
-        print("!! TAMPERING DETECTED: Genesis hash (line 1) is incorrect. !!")
-        return False
-
-    for i in range(1, len(df)):
-        # Get the previous line (as a string, exactly as logged)
-        prev_line_data = df.iloc[i - 1]
-        prev_line_string = f"{prev_line_data['timestamp']},{prev_line_data['pressure_delta']:.2f},{prev_line_data['vibration_mag']:.2f}," \
-                           f"{prev_line_data['audio_level']},{prev_line_data['dust_voltage']:.3f},{prev_line_data['lat']:.6f}," \
-                           f"{prev_line_data['lon']:.6f},{prev_line_data['alt']:.1f},{prev_line_data['prev_hash']}"
-
-        # Calculate its hash
-        expected_hash = hashlib.sha256(prev_line_string.encode('utf-8')).hexdigest()
-
-        # Compare to the hash stored in the current line
-        stored_hash = df.iloc[i]['prev_hash']
-
-        if expected_hash != stored_hash:
-            print(f"!! TAMPERING DETECTED at line {i + 1} !!")
-            print(f"  Stored Hash:   {stored_hash}")
-            print(f"  Expected Hash: {expected_hash}")
-            is_valid = False
-            break
-
-    if is_valid:
-        print("VERIFIED: Log file integrity is 100%. No tampering detected.")
-    else:
+    # The reader parses lazily: a blanked or garbled field (e.g. NA in an integer
+    # column) raises while iterating and is reported like any other tampering
+    try:
+        for chunk in chunks:
+            if last_line is None and list(chunk.columns) != LOG_COLUMNS:
+                print(f"!! INVALID LOG: Header {','.join(map(str, chunk.columns))} is not the expected "
+                      f"{','.join(LOG_COLUMNS)} (tampered, or written by other firmware). !!")
+                return None
+            if chunk.empty:
+                continue
+            stored_hashes = chunk['prev_hash'].to_numpy()
+
+            # Check genesis block (a blanked hash reads as NA, which can't be compared)
+            if last_line is None and (pd.isna(stored_hashes[0]) or stored_hashes[0] != GENESIS_HASH):
+                print("!! TAMPERING DETECTED: Genesis hash (line 1) is incorrect. !!")
+                return None
+
+            # Compare raw digests, so decode the stored hex once up front
+            try:
+                stored_digests = [bytes.fromhex(h) for h in stored_hashes]
+            except (TypeError, ValueError):
+                print("!! TAMPERING DETECTED: Log contains a malformed hash. !!")
+                return None
+
+            # Rebuild every hashed message in one pass: the line's data fields
+            # exactly as logged, then the previous link's raw digest
+            rows = chunk[LOG_COLUMNS[:-1]].itertuples(index=False, name=None)
+            lines = [f"{ts},{dp:.2f},{vib_sq},{audio},{dust},{lat:.6f},{lon:.6f},{alt:.1f},".encode('ascii') + prev
+                     for (ts, dp, vib_sq, audio, dust, lat, lon, alt), prev in zip(rows, stored_digests)]
+
+            # The chunk's first stored hash links back to the previous chunk's last line
+            if last_line is not None and chain_digest(last_line) != stored_digests[0]:
+                broken, broken_line, stored_hash = first_row - 1, last_line, stored_hashes[0]
+            else:
+                broken = find_broken_link(lines[:-1], stored_digests[1:])
+                if broken is not None:
+                    broken_line, stored_hash = lines[broken], stored_hashes[broken + 1]
+                    broken += first_row
+
+            if broken is not None:
+                print(f"!! TAMPERING DETECTED at line {broken + 2} !!")
+                print(f"  Stored Hash:   {stored_hash}")
+                print(f"  Expected Hash: {chain_digest(broken_line).hex()}")
+                is_valid = False
+                break
+
+            last_line = lines[-1]
+            first_row += len(chunk)
+            verified.append(chunk[ANALYSIS_COLUMNS])
+    except (ValueError, TypeError) as e:
+        print(f"!! TAMPERING DETECTED: Log is malformed ({e}). !!")
+        is_valid = False
+
+    if not is_valid:
         print("CRITICAL: Log file has been tampered with. Analysis is unreliable.")
+        return None
+    if not verified:
+        print("CRITICAL: Log file contains no entries.")
+        return None
+
+    print("VERIFIED: Log file integrity is 100%. No tampering detected.")
+    data = pd.concat(verified, ignore_index=True)
+    # Hash of the last line: fingerprints the entire verified log
+    data.attrs['chain_hash'] = hashlib.sha256(last_line).hexdigest()
+    return data
+
+
+def fit_model(model, X, chain_hash=None):
+    """Fits the model on X, reusing a cached fit (if MODEL_CACHE_DIR is set) for the
+    same log, feature pipeline, parameters and sklearn version."""
+    if chain_hash is None or not MODEL_CACHE_DIR:
+        return model.fit(X)
+
+    spec = (chain_hash, FEATURES, DUST_VOLTS_PER_COUNT, str(X.dtype), X.shape, sklearn.__version__,
+            sorted(model.get_params().items()))
+    key = hashlib.sha256(repr(spec).encode('utf-8')).hexdigest()
+    path = os.path.join(MODEL_CACHE_DIR, f"if_{key}.joblib")
+    if os.path.exists(path):
+        print(f"Loaded cached model '{path}'")
+        return joblib.load(path)
+
+    model.fit(X)
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    joblib.dump(model, path)
+    return model
+
 
-    return is_valid
+def print_table(df, columns):
+    """Prints df[columns] as a tab-separated table (cheaper than the DataFrame repr)."""
+    np.savetxt(sys.stdout, df[columns].to_numpy(dtype=np.float64), delimiter='\t',
+               fmt=[COLUMN_FORMATS[c] for c in columns], header='\t'.join(columns), comments='')
+
+
+def get_map_axes():
+    """Returns the script's one map figure and axes, cleared for a new plot."""
+    global _map_fig, _map_ax
+    if _map_fig is None:
+        _map_fig, _map_ax = plt.subplots(figsize=(12, 8))
+    else:
+        for extra_ax in _map_fig.axes:
+            if extra_ax is not _map_ax:
+                extra_ax.remove()  # Colorbar from the previous plot
+        _map_ax.clear()
+    return _map_fig, _map_ax
 
 
 def analyze_log(df):
     print("\n--- SENSOR LOG ANALYSIS (V4.0) ---")
 
     # 1. Prepare data for ML
-    scaler = StandardScaler()
-    df_scaled = scaler.fit_transform(df[FEATURES])
+    df['dust_voltage'] = df['dust_raw'] * DUST_VOLTS_PER_COUNT
+    # The firmware logs the squared gyro magnitude, leaving the root to us
+    df['vibration_mag'] = np.sqrt(df['vibration_mag_sq'].to_numpy(dtype=np.float64))
+    # float32 halves the bytes sklearn has to scan. No scaling: IsolationForest
+    # cuts each axis between its min and max, so per-feature rescaling such as
+    # StandardScaler does not change its splits.
+    X = np.ascontiguousarray(df[FEATURES].to_numpy(dtype=np.float32))
 
     # 2. Train Anomaly Detection Model
-    model = IsolationForest(contamination=0.001, random_state=42)
+    # Each tree only needs a 256-point subsample (the iForest paper default,
+    # capped at the log's length so short logs don't trigger a warning);
+    # build the trees on every core. contamination='auto' keeps fit() from
+    # scoring X itself; the threshold is taken from the single pass below.
+    model = IsolationForest(contamination='auto', random_state=42, n_estimators=100,
+                            max_samples=min(256, len(X)), bootstrap=False, n_jobs=-1)
     print("Training ML model on 4-sensor data...")
-    model.fit(df_scaled)
+    model = fit_model(model, X, df.attrs.get('chain_hash'))
 
-    # 3. Predict Anomalies
+    # 3. Predict Anomalies (one pass over the trees instead of fit + predict)
     print("Predicting anomalies...")
-    df['is_anomaly'] = model.predict(df_scaled)  # -1 for anomaly
+    scores = model.score_samples(X)
+    threshold = np.percentile(scores, 100.0 * CONTAMINATION)
+    is_attack = scores < threshold
+    df['is_anomaly'] = np.where(is_attack, -1, 1)  # -1 for anomaly
 
-    attacks = df[df['is_anomaly'] == -1]
+    # Build the row masks once, straight from NumPy (no temporary Series)
+    has_gps = (df['lat'].to_numpy() != 0.0) & (df['lon'].to_numpy() != 0.0)
+    attacks = df[is_attack]
 
     if attacks.empty:
         print("\n--- RESULT ---")
         print("No significant anomalies (attacks) detected in the log.")
     else:
         print(f"\n--- {len(attacks)} ANOMALOUS EVENTS DETECTED ---")
-        attacks_with_gps = attacks[(attacks['lat'] != 0.0) & (attacks['lon'] != 0.0)]
+        attacks_with_gps = df[is_attack & has_gps]
 
         if attacks_with_gps.empty:
             print("Found attacks, but none had a GPS lock.")
-            print(attacks[FEATURES])
+            print_table(attacks, FEATURES)
         else:
             print("Attacks with valid GPS data:")
-            print(attacks_with_gps[['lat', 'lon'] + FEATURES])
+            print_table(attacks_with_gps, ['lat', 'lon'] + FEATURES)
 
             # 4. Generate Attack Map
             print("Generating attack map...")
-            plt.figure(figsize=(12, 8))
-
-            df_gps_normal = df[(df['lat'] != 0.0) & (df['lon'] != 0.0) & (df['is_anomaly'] == 1)]
-            plt.scatter(df_gps_normal['lon'], df_gps_normal['lat'], c='grey', alpha=0.1, s=1, label='Normal Path')
-
-            plt.scatter(attacks_with_gps['lon'], attacks_with_gps['lat'], c=attacks_with_gps['dust_voltage'],
-                        cmap='Reds', s=50, label='Attack (Color=Dust)', edgecolors='black')
-
-            plt.xlabel('Longitude')
-            plt.ylabel('Latitude')
-            plt.title('V4.0 Forensic Map: Attack Location (Color by Dust Level)')
-            plt.colorbar(label='Dust Sensor Voltage')
-            plt.legend()
-            plt.grid(True)
-            plt.axis('equal')
-            plt.savefig('attack_map_V4_forensic.png')
+            fig, ax = get_map_axes()
+
+            df_gps_normal = df[has_gps & ~is_attack]
+            # Bin the (huge) normal path into hexagons instead of drawing one marker per point
+            ax.hexbin(df_gps_normal['lon'], df_gps_normal['lat'], gridsize=200, cmap='Greys', mincnt=1,
+                      alpha=0.5, label='Normal Path', rasterized=True)
+
+            attack_points = ax.scatter(attacks_with_gps['lon'], attacks_with_gps['lat'],
+                                       c=attacks_with_gps['dust_voltage'], cmap='Reds', s=50,
+                                       label='Attack (Color=Dust)', edgecolors='black')
+
+            ax.set_xlabel('Longitude')
+            ax.set_ylabel('Latitude')
+            ax.set_title('V4.0 Forensic Map: Attack Location (Color by Dust Level)')
+            fig.colorbar(attack_points, ax=ax, label='Dust Sensor Voltage')
+            ax.legend()
+            ax.grid(True)
+            ax.axis('equal')
+            fig.savefig('attack_map_V4_forensic.png', dpi=150)
             print("Saved 'attack_map_V4_forensic.png'")
-            plt.clf()
 
 
 if __name__ == "__main__":
-    if not os.path.exists(LOG_FILE):
-        print(f"Error: {LOG_FILE} not found. Copy it from the SD card.")
+    # Default log, or e.g. a rotated forensic_log_v4.1.csv given on the command line
+    log_file = sys.argv[1] if len(sys.argv) > 1 else LOG_FILE
+    if not os.path.exists(log_file):
+        print(f"Error: {log_file} not found. Copy it from the SD card.")
     else:
-        print(f"Loading log file: {LOG_FILE}...")
-        data = pd.read_csv(LOG_FILE)
-
-        # Verify the hash chain *first*
-        if verify_hash_chain(data):
+        print(f"Loading log file: {log_file}...")
+        # Verify the hash chain *first*, keeping only what the analysis needs
+        data = verify_hash_chain(read_log(log_file))
+        if data is not None:
             # If valid, proceed with analysis
             analyze_log(data)
         else:
@@ -11,6 +11,7 @@
 #   https://github.com/df-robot/DFRobot_BME280_MicroPython
 #   https://github.com/HowToElectronics/MicroPython-BME280-Raspberry-Pi-Pico
 #
+import struct
 import time
 from machine import I2C
 from micropython import const
@@ -48,6 +49,9 @@ BME280_STANDBY_1000 = const(0x05)
 BME280_STANDBY_10 = const(0x06)
 BME280_STANDBY_20 = const(0x07)
 
+# Max age (ms) of a raw sample reused by read_raw_data()
+BME280_RAW_CACHE_MS = const(10)
+
 # BME280 Registers
 BME280_REG_ID = const(0xD0)
 BME280_REG_RESET = const(0xE0)
@@ -97,37 +101,30 @@ class BME280:
             raise ValueError('I2C object required.')
         self.i2c = i2c
 
-        self.dig_T1 = self._read16(BME280_REG_DIG_T1, unsigned=True)
-        self.dig_T2 = self._read16(BME280_REG_DIG_T2)
-        self.dig_T3 = self._read16(BME280_REG_DIG_T3)
-
-        self.dig_P1 = self._read16(BME280_REG_DIG_P1, unsigned=True)
-        self.dig_P2 = self._read16(BME280_REG_DIG_P2)
-        self.dig_P3 = self._read16(BME280_REG_DIG_P3)
-        self.dig_P4 = self._read16(BME280_REG_DIG_P4)
-        self.dig_P5 = self._read16(BME280_REG_DIG_P5)
-        self.dig_P6 = self._read16(BME280_REG_DIG_P6)
-        self.dig_P7 = self._read16(BME280_REG_DIG_P7)
-        self.dig_P8 = self._read16(BME280_REG_DIG_P8)
-        self.dig_P9 = self._read16(BME280_REG_DIG_P9)
-
-        self.dig_H1 = self._read8(BME280_REG_DIG_H1, unsigned=True)
-        self.dig_H2 = self._read16(BME280_REG_DIG_H2)
-        self.dig_H3 = self._read8(BME280_REG_DIG_H3, unsigned=True)
-
-        h4 = self._read8(BME280_REG_DIG_H4)
-        h5 = self._read8(BME280_REG_DIG_H5)
-        self.dig_H4 = (h4 << 4) | (h5 & 0x0F)
+        # Calibration data lives in two contiguous blocks: 0x88-0xA1 and 0xE1-0xE7.
+        # Read each in one burst instead of one I2C transaction per coefficient.
+        buf1 = self.i2c.readfrom_mem(self.address, BME280_REG_DIG_T1, 26)
+        buf2 = self.i2c.readfrom_mem(self.address, BME280_REG_DIG_H2, 7)
 
-        h5_msb = self._read8(BME280_REG_DIG_H5 + 1)
-        self.dig_H5 = (h5_msb << 4) | (h5 >> 4)
+        (self.dig_T1, self.dig_T2, self.dig_T3,
+         self.dig_P1, self.dig_P2, self.dig_P3, self.dig_P4, self.dig_P5,
+         self.dig_P6, self.dig_P7, self.dig_P8, self.dig_P9) = struct.unpack_from('<HhhHhhhhhhhh', buf1, 0)
 
-        self.dig_H6 = self._read8(BME280_REG_DIG_H6)
+        self.dig_H1 = buf1[25]
+        # H4 and H5 are signed 12-bit values sharing the 0xE5 byte: the signed
+        # 0xE4/0xE6 bytes carry the sign, 0xE5 is split into unsigned nibbles.
+        self.dig_H2, self.dig_H3, h4, h45, h5, self.dig_H6 = struct.unpack_from('<hBbBbb', buf2, 0)
+        self.dig_H4 = (h4 << 4) | (h45 & 0x0F)
+        self.dig_H5 = (h5 << 4) | (h45 >> 4)
 
         self._write8(BME280_REG_CTRL_HUM, mode)
 
         self.t_fine = 0
 
+        # Last raw burst, reused by reads within BME280_RAW_CACHE_MS of it
+        self._cache_ts = 0
+        self._cache_raw = None
+
         # Default settings
         self.oversample_temp = BME280_OS_1X
         self.oversample_pres = BME280_OS_1X
@@ -146,10 +143,7 @@ class BME280:
 
     def _read16(self, register, unsigned=False):
         data = self.i2c.readfrom_mem(self.address, register, 2)
-        value = (data[1] << 8) | data[0]
-        if not unsigned and value & 0x8000:
-            value -= 0x10000
-        return value
+        return struct.unpack('<H' if unsigned else '<h', data)[0]
 
     def _write8(self, register, value):
         self.i2c.writeto_mem(self.address, register, bytearray([value]))
@@ -163,61 +157,69 @@ class BME280:
         self._write8(BME280_REG_CTRL_MEAS, ctrl_meas)
 
     def read_raw_data(self):
+        # Reading temperature, pressure and humidity back to back costs one burst
+        now = time.ticks_ms()
+        if self._cache_raw is not None and time.ticks_diff(now, self._cache_ts) < BME280_RAW_CACHE_MS:
+            return self._cache_raw
+
         # Read temperature, pressure, and humidity registers
         data = self.i2c.readfrom_mem(self.address, BME280_REG_PRESS_MSB, 8)
 
-        raw_press = (data[0] << 12) | (data[1] << 4) | (data[2] >> 4)
-        raw_temp = (data[3] << 12) | (data[4] << 4) | (data[5] >> 4)
-        raw_hum = (data[6] << 8) | data[7]
+        # 20-bit big-endian pressure/temperature, 16-bit big-endian humidity
+        raw_press = int.from_bytes(data[0:3], 'big') >> 4
+        raw_temp = int.from_bytes(data[3:6], 'big') >> 4
+        raw_hum = struct.unpack_from('>H', data, 6)[0]
 
-        return raw_temp, raw_press, raw_hum
+        self._cache_ts = now
+        self._cache_raw = (raw_temp, raw_press, raw_hum)
+        return self._cache_raw
 
+    # Integer compensation formulas from the Bosch BME280 datasheet. These give
+    # the reference results exactly; MicroPython floats on the ESP32 are single
+    # precision, so the floating-point variants round their intermediates. This
+    # is for accuracy, not speed: the 64-bit pressure intermediates exceed the
+    # small-int range and are heap-allocated bignums.
     def _compensate_temperature(self, raw_temp):
-        var1 = (raw_temp / 16384.0 - self.dig_T1 / 1024.0) * self.dig_T2
-        var2 = ((raw_temp / 131072.0 - self.dig_T1 / 8192.0) * (
-                    raw_temp / 131072.0 - self.dig_T1 / 8192.0)) * self.dig_T3
+        var1 = (((raw_temp >> 3) - (self.dig_T1 << 1)) * self.dig_T2) >> 11
+        var2 = (((((raw_temp >> 4) - self.dig_T1) * ((raw_temp >> 4) - self.dig_T1)) >> 12) * self.dig_T3) >> 14
         self.t_fine = var1 + var2
-        temperature = self.t_fine / 5120.0
-        return temperature
+        temperature = (self.t_fine * 5 + 128) >> 8
+        return temperature / 100  # 0.01 degC -> degC
 
     def _compensate_pressure(self, raw_press):
-        if self.t_fine == 0:
-            self._compensate_temperature(self.read_raw_data()[0])  # Force temp reading if not done
-
-        var1 = self.t_fine / 2.0 - 64000.0
-        var2 = var1 * var1 * self.dig_P6 / 32768.0
-        var2 = var2 + var1 * self.dig_P5 * 2.0
-        var2 = var2 / 4.0 + self.dig_P4 * 65536.0
-        var1 = (self.dig_P3 * var1 * var1 / 524288.0 + self.dig_P2 * var1) / 524288.0
-        var1 = (1.0 + var1 / 32768.0) * self.dig_P1
+        # Requires t_fine from _compensate_temperature() on the same sample
+        var1 = self.t_fine - 128000
+        var2 = var1 * var1 * self.dig_P6
+        var2 = var2 + ((var1 * self.dig_P5) << 17)
+        var2 = var2 + (self.dig_P4 << 35)
+        var1 = ((var1 * var1 * self.dig_P3) >> 8) + ((var1 * self.dig_P2) << 12)
+        var1 = (((1 << 47) + var1) * self.dig_P1) >> 33
 
         if var1 == 0:
             return 0  # Avoid division by zero
 
-        p = 1048576.0 - raw_press
-        p = (p - var2 / 4096.0) * 6250.0 / var1
-        var1 = self.dig_P9 * p * p / 2147483648.0
-        var2 = p * self.dig_P8 / 32768.0
-        p = p + (var1 + var2 + self.dig_P7) / 16.0
+        p = 1048576 - raw_press
+        p = (((p << 31) - var2) * 3125) // var1
+        var1 = (self.dig_P9 * (p >> 13) * (p >> 13)) >> 25
+        var2 = (self.dig_P8 * p) >> 19
+        p = ((p + var1 + var2) >> 8) + (self.dig_P7 << 4)
 
-        return p  # Pressure in Pa
+        return p / 256  # Q24.8 -> Pressure in Pa
 
     def _compensate_humidity(self, raw_hum):
-        if self.t_fine == 0:
-            self._compensate_temperature(self.read_raw_data()[0])  # Force temp reading if not done
-
-        h = self.t_fine - 76800.0
-        h = (raw_hum - (self.dig_H4 * 64.0 + self.dig_H5 / 16384.0 * h)) * \
-            (self.dig_H2 / 65536.0 * (1.0 + self.dig_H6 / 67108864.0 * h * \
-                                      (1.0 + self.dig_H3 / 67108864.0 * h)))
-        h = h * (1.0 - self.dig_H1 * h / 524288.0)
+        # Requires t_fine from _compensate_temperature() on the same sample
+        h = self.t_fine - 76800
+        h = (((((raw_hum << 14) - (self.dig_H4 << 20) - (self.dig_H5 * h)) + 16384) >> 15) *
+             (((((((h * self.dig_H6) >> 10) * (((h * self.dig_H3) >> 11) + 32768)) >> 10) + 2097152) *
+               self.dig_H2 + 8192) >> 14))
+        h = h - (((((h >> 15) * (h >> 15)) >> 7) * self.dig_H1) >> 4)
 
-        if h > 100.0:
-            h = 100.0
-        elif h < 0.0:
-            h = 0.0
+        if h < 0:
+            h = 0
+        elif h > 419430400:
+            h = 419430400
 
-        return h  # Humidity in %RH
+        return (h >> 12) / 1024  # Q22.10 -> Humidity in %RH
 
     @property
     def temperature(self):
@@ -228,13 +230,15 @@ class BME280:
     @property
     def pressure(self):
         """Returns pressure in Pascals"""
-        _, raw_press, _ = self.read_raw_data()
+        raw_temp, raw_press, _ = self.read_raw_data()
+        self._compensate_temperature(raw_temp)
         return self._compensate_pressure(raw_press)
 
     @property
     def humidity(self):
         """Returns relative humidity in %"""
-        _, _, raw_hum = self.read_raw_data()
+        raw_temp, _, raw_hum = self.read_raw_data()
+        self._compensate_temperature(raw_temp)
         return self._compensate_humidity(raw_hum)
 
     @property
@@ -3,6 +3,7 @@
 
 from machine import Pin, ADC
 import time
+import uasyncio as asyncio
 
 
 class DustSensor:
@@ -12,7 +13,7 @@ class DustSensor:
         self.adc.atten(ADC.ATTN_11DB)  # Full 0-3.6V range
         self.led.value(1)  # LED is off by default (inverted logic)
 
-    def read_voltage(self):
+    async def read_raw(self):
         # This sensor requires a specific pulse sequence
 
         # 1. Turn LED on (pull low)
@@ -21,8 +22,8 @@ class DustSensor:
         # 2. Wait 280 microseconds for LED to stabilize
         time.sleep_us(280)
 
-        # 3. Read ADC
-        adc_val = self.adc.read()
+        # 3. Read ADC (scaled to 0-65535 by the port, oversampled where supported)
+        adc_val = self.adc.read_u16()
 
         # 4. Wait 40us
         time.sleep_us(40)
@@ -31,20 +32,26 @@ class DustSensor:
         self.led.value(1)
 
         # 6. Wait 9680us to complete 10ms cycle
-        time.sleep_us(9680)
+        # The LED pulse above is busy-waited to keep the ADC timing exact; this
+        # quiet window only has a lower bound, so let other tasks run during it.
+        await asyncio.sleep_ms(9)
+        time.sleep_us(680)
 
-        # Convert 12-bit ADC (0-4095) to voltage (0-3.3V)
+        # We log the raw count for the ML model; analysis.py scales it to volts
+        return adc_val
+
+    async def read_voltage(self):
+        # Convert 16-bit ADC (0-65535) to voltage (0-3.3V)
         # Using 3.3V as reference
-        voltage = (adc_val / 4095) * 3.3
+        voltage = (await self.read_raw() / 65535) * 3.3
 
         # The sensor datasheet says output is ~0.5V to ~3.5V
-        # But we will log the raw voltage for the ML model
         return voltage
 
-    def read_dust_density(self):
+    async def read_dust_density(self):
         # This provides a calibrated value, but we don't need it
         # for ML anomaly detection. We'll use raw voltage.
-        v = self.read_voltage()
+        v = await self.read_voltage()
 
         # Calibration from datasheet (approximate)
         if v < 0.5:
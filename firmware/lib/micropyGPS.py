@@ -4,6 +4,19 @@
 # Heavily modified for simplicity
 
 import time
+import micropython
+from micropython import const
+
+_SENTENCE_MAX = const(96)  # NMEA caps a sentence at 82 characters
+
+
+@micropython.native
+def _nmea_checksum(payload):
+    # XOR of every character between '$' and '*'
+    checksum = 0
+    for char in payload:
+        checksum ^= ord(char)
+    return checksum
 
 
 class MicropyGPS:
@@ -14,6 +27,9 @@ class MicropyGPS:
         self.satellites_used = 0
         self.timestamp = (0, 0, 0.0)
         self.fix_stat = 0
+        # Sentence being assembled from raw UART bytes (see feed)
+        self._sentence = bytearray(_SENTENCE_MAX)
+        self._length = 0
 
     def _parse_lat_lon(self, part_str, direction_str):
         if not part_str:
@@ -29,6 +45,25 @@ class MicropyGPS:
         except ValueError:
             return 0.0
 
+    @micropython.native
+    def feed(self, buf, n):
+        # Assembles sentences from the first n raw bytes in buf, byte by byte
+        # and in place; only complete GGA sentences are decoded and parsed
+        sentence = self._sentence
+        length = self._length
+        for i in range(n):
+            c = buf[i]
+            if c == 0x24:  # '$' starts a sentence
+                length = 0
+            if c == 0x0A:  # '\n' ends it
+                if length > 6 and sentence[3] == 0x47 and sentence[4] == 0x47 and sentence[5] == 0x41:  # "GGA"
+                    self.update(sentence[:length].decode('utf-8'))
+                length = 0
+            elif length < _SENTENCE_MAX:
+                sentence[length] = c
+                length += 1
+        self._length = length
+
     def update(self, sentence):
         try:
             if not sentence or not sentence.startswith('$GPGGA'):
@@ -41,10 +76,7 @@ class MicropyGPS:
             # Check checksum (optional but good)
             try:
                 payload, checksum = sentence.strip().split('*')
-                calc_checksum = 0
-                for char in payload[1:]:
-                    calc_checksum ^= ord(char)
-                if int(checksum, 16) != calc_checksum:
+                if int(checksum, 16) != _nmea_checksum(payload[1:]):
                     return False  # Checksum mismatch
             except:
                 return False  # Checksum parse error
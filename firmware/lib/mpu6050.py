@@ -4,12 +4,14 @@
 # Based on the work by J.C. Waryn
 # https://github.com/m-rtijn/mpu6050
 
+import struct
 from machine import I2C
 
 class accel():
     def __init__(self, i2c, addr=0x68):
         self.iic = i2c
         self.addr = addr
+        self.gyro_buf = bytearray(6)  # GYRO_XOUT_H .. GYRO_ZOUT_L
         self.iic.writeto(self.addr, bytearray([107, 0])) # Wake up MPU6050
 
     def get_raw_values(self):
@@ -64,3 +66,9 @@ class accel():
     def get_gyro_z(self):
         raw_ints = self.get_raw_values()
         return self.bytes_toint(raw_ints[12], raw_ints[13])
+
+    def get_gyro(self):
+        # One 6-byte burst of just the gyro registers into a reusable buffer
+        # (no accel/temp bytes, no dict)
+        self.iic.readfrom_mem_into(self.addr, 0x43, self.gyro_buf)
+        return struct.unpack(">hhh", self.gyro_buf)  # Big-endian int16 x, y, z
@@ -7,10 +7,13 @@ This is a port of the Arduino SD library for MicroPython.
 (https://github.com/arduino-libraries/SD)
 """
 
+import struct
 import time
 from micropython import const
 
 _CMD_TIMEOUT = const(100)
+_SAFE_BAUDRATE = const(10000000)  # Fallback clock every card handles
+_BUSY_POLLS = const(256)  # Polls before _wait_byte starts sleeping between them
 
 _R1_IDLE_STATE = const(1 << 0)
 _R1_ERASE_RESET = const(1 << 1)
@@ -52,25 +55,58 @@ _CMD55 = const(55)  # APP_CMD
 _CMD58 = const(58)  # READ_OCR
 _ACMD41 = const(41)  # SD_SEND_OP_COND (application-specific)
 
+# Data tokens
+_TOKEN_DATA = const(0xFE)  # Single/multi-block read, single-block write
+_TOKEN_CMD25 = const(0xFC)  # Multi-block write
+_TOKEN_STOP_TRAN = const(0xFD)  # End of multi-block write
+
 # Card types
 _CARD_TYPE_SD1 = const(1)
 _CARD_TYPE_SD2 = const(2)
 _CARD_TYPE_SDHC = const(3)
 
 
+def _crc7(buf, n):
+    # CRC7 (polynomial x^7 + x^3 + 1) of buf[:n], as used by SD commands and registers
+    crc = 0
+    for i in range(n):
+        b = buf[i]
+        for _ in range(8):
+            crc <<= 1
+            if (b ^ crc) & 0x80:
+                crc ^= 0x09
+            b <<= 1
+        crc &= 0x7F
+    return crc
+
+
 class SDCard:
-    def __init__(self, spi, cs):
+    # Dummy-clock / CRC-skip fillers, shared so no call site builds its own
+    _FF1 = b"\xff"
+    _FF2 = b"\xff\xff"
+    _FF10 = b"\xff" * 10
+
+    def __init__(self, spi, cs, max_baudrate=20000000):
         self.spi = spi
         self.cs = cs
+        self.max_baudrate = max_baudrate
+        self.baudrate = None  # Clock actually in use, set by init_card
+
+        # Bound-method caches: saves an attribute lookup per byte in the polling loops
+        self._spi_write = spi.write
+        self._spi_readinto = spi.readinto
+        self._pack_into = struct.pack_into
 
         self.cmdbuf = bytearray(6)
         self.tokenbuf = bytearray(1)
-        self.buf = bytearray(512)
+        self._r7tail = bytearray(4)  # Trailing 4 bytes of an R7/R3 response (OCR for CMD58)
 
         self.cs.init(self.cs.OUT, value=1)
 
         self.card_type = None
+        self._addr_shift = 0
         self.csd = None
+        self._num_blocks = -1
         self.cid = None
         self.ocr = None
         self.init_card()
@@ -89,8 +125,7 @@ class SDCard:
             # If your port's default is high, you may need to pass baudrate in SPI constructor
 
         # 80 dummy clock cycles
-        for _ in range(10):
-            self.spi.write(b"\xff")
+        self._spi_write(self._FF10)
 
         # Select card
         self.cs.value(0)
@@ -128,25 +163,39 @@ class SDCard:
         if self.card_type == _CARD_TYPE_SD2:
             if self._cmd_r7(_CMD58, 0) != 0:
                 raise OSError("SD card: Error on CMD58")
-            if self.tokenbuf[0] & 0x40:
+            if self._r7tail[0] & 0x40:
                 self.card_type = _CARD_TYPE_SDHC
 
+        # SDHC is block-addressed; SDv1/v2 take byte addresses (block * 512)
+        self._addr_shift = 0 if self.card_type == _CARD_TYPE_SDHC else 9
+
         # Set block size to 512 bytes
         if self._cmd(_CMD16, 512) != 0:
             raise OSError("SD card: Error on CMD16 (set blocklen)")
 
-        # Set SPI to full speed
-        # Note: 10MHz is a safe speed. Some cards support 20MHz+.
-        self.spi.init(baudrate=10000000)
-
         # Deselect card
         self.cs.value(1)
-        self.spi.write(b"\xff")  # Dummy clock
+        self._spi_write(self._FF1)  # Dummy clock
 
-        # Read CSD
+        # Read CSD at full speed. Many cards (and short leads) run at 20MHz+;
+        # the CSD's own CRC7 shows whether this one does, otherwise drop
+        # back to 10MHz, which is safe for any card.
         self.csd = bytearray(16)
-        if self._readinto(_CMD9, self.csd) != 0:
-            raise OSError("SD card: Error reading CSD")
+        self.baudrate = self.max_baudrate
+        self.spi.init(baudrate=self.baudrate)
+        if self._readinto(_CMD9, self.csd) != 0 or _crc7(self.csd, 15) != self.csd[15] >> 1:
+            if self.baudrate <= _SAFE_BAUDRATE:
+                raise OSError("SD card: Error reading CSD")
+            self.baudrate = _SAFE_BAUDRATE
+            self.spi.init(baudrate=self.baudrate)
+            # Clock out whatever is left of the garbled CSD transfer
+            self.cs.value(0)
+            for _ in range(4):
+                self._spi_write(self._FF10)
+            self.cs.value(1)
+            if self._readinto(_CMD9, self.csd) != 0:
+                raise OSError("SD card: Error reading CSD")
+        self._num_blocks = self._csd_num_blocks()
 
         # Read CID
         self.cid = bytearray(16)
@@ -157,69 +206,77 @@ class SDCard:
         self.ocr = bytearray(4)
         if self._cmd_r7(_CMD58, 0) != 0:
             raise OSError("SD card: Error reading OCR")
-        self.ocr[:] = self.tokenbuf[0:4]
+        self.ocr[:] = self._r7tail
 
     def _cmd(self, cmd, arg, crc=0):
-        self.cmdbuf[0] = 0x40 | cmd
-        self.cmdbuf[1] = (arg >> 24) & 0xFF
-        self.cmdbuf[2] = (arg >> 16) & 0xFF
-        self.cmdbuf[3] = (arg >> 8) & 0xFF
-        self.cmdbuf[4] = arg & 0xFF
-        self.cmdbuf[5] = crc
+        # Command byte, 32-bit big-endian argument, CRC byte
+        self._pack_into(">BIB", self.cmdbuf, 0, 0x40 | cmd, arg, crc)
 
         self.cs.value(0)
-        self.spi.write(self.cmdbuf)
+        self._spi_write(self.cmdbuf)
 
         # Wait for response
         for _ in range(_CMD_TIMEOUT):
-            self.spi.readinto(self.tokenbuf, 0xFF)
+            self._spi_readinto(self.tokenbuf, 0xFF)
             if not (self.tokenbuf[0] & 0x80):
                 self.cs.value(1)
-                self.spi.write(b"\xff")  # Dummy clock
+                self._spi_write(self._FF1)  # Dummy clock
                 return self.tokenbuf[0]
 
         # Timeout
         self.cs.value(1)
-        self.spi.write(b"\xff")  # Dummy clock
+        self._spi_write(self._FF1)  # Dummy clock
         return -1  # Error
 
     def _cmd_r7(self, cmd, arg, crc=0):
-        self.cmdbuf[0] = 0x40 | cmd
-        self.cmdbuf[1] = (arg >> 24) & 0xFF
-        self.cmdbuf[2] = (arg >> 16) & 0xFF
-        self.cmdbuf[3] = (arg >> 8) & 0xFF
-        self.cmdbuf[4] = arg & 0xFF
-        self.cmdbuf[5] = crc
+        # Command byte, 32-bit big-endian argument, CRC byte
+        self._pack_into(">BIB", self.cmdbuf, 0, 0x40 | cmd, arg, crc)
 
         self.cs.value(0)
-        self.spi.write(self.cmdbuf)
+        self._spi_write(self.cmdbuf)
 
         # Wait for response
         for _ in range(_CMD_TIMEOUT):
-            self.spi.readinto(self.tokenbuf, 0xFF)
+            self._spi_readinto(self.tokenbuf, 0xFF)
             if not (self.tokenbuf[0] & 0x80):
-                # Read remaining 4 bytes of R7 response
-                self.spi.readinto(self.tokenbuf, 0xFF)
-                self.spi.readinto(self.tokenbuf, 0xFF)
-                self.spi.readinto(self.tokenbuf, 0xFF)
-                self.spi.readinto(self.tokenbuf, 0xFF)
+                # Read remaining 4 bytes of R7/R3 response in one transfer
+                self._spi_readinto(self._r7tail, 0xFF)
                 self.cs.value(1)
-                self.spi.write(b"\xff")  # Dummy clock
-                return 0  # Success (R1 part of R7 is 0)
+                self._spi_write(self._FF1)  # Dummy clock
+                return self.tokenbuf[0]  # R1 part of the response
 
         # Timeout
         self.cs.value(1)
-        self.spi.write(b"\xff")  # Dummy clock
+        self._spi_write(self._FF1)  # Dummy clock
         return -1  # Error
 
-    def _wait_ready(self):
+    def _wait_byte(self, value, timeout_ms):
+        # Busy-poll for value at first: a byte takes about a microsecond on the
+        # bus, so a sleep per poll would dwarf a quick card's latency. A card still
+        # busy after _BUSY_POLLS is programming or erasing (up to hundreds of ms),
+        # so from then on sleep 1 ms per poll, which releases the GIL and the core
+        # to the sampling loop while the log writer thread waits here.
+        readinto = self._spi_readinto
+        buf = self.tokenbuf
         start_time = time.ticks_ms()
-        while time.ticks_diff(time.ticks_ms(), start_time) < 500:
-            self.spi.readinto(self.tokenbuf, 0xFF)
-            if self.tokenbuf[0] == 0xFF:
+        polls = 0
+        while True:
+            readinto(buf, 0xFF)
+            if buf[0] == value:
                 return 0
-            time.sleep_ms(1)
-        return -1  # Timeout
+            polls += 1
+            if polls >= _BUSY_POLLS:
+                if time.ticks_diff(time.ticks_ms(), start_time) >= timeout_ms:
+                    return -1  # Timeout
+                time.sleep_ms(1)
+
+    def _wait_ready(self):
+        # Card releases the bus (0xFF) once it finishes programming
+        return self._wait_byte(0xFF, 500)
+
+    def _wait_token(self, token):
+        # Wait for a data start token from the card
+        return self._wait_byte(token, 200)
 
     def _readinto(self, cmd, buf, arg=0):
         if self._cmd(cmd, arg) != 0:
@@ -228,116 +285,146 @@ class SDCard:
         self.cs.value(0)
 
         # Wait for data token
-        start_time = time.ticks_ms()
-        while time.ticks_diff(time.ticks_ms(), start_time) < 200:
-            self.spi.readinto(self.tokenbuf, 0xFF)
-            if self.tokenbuf[0] == 0xFE:  # Start block token
-                break
-            time.sleep_ms(1)
-        else:
+        if self._wait_token(_TOKEN_DATA) != 0:
             self.cs.value(1)
-            self.spi.write(b"\xff")
+            self._spi_write(self._FF1)
             return -1  # Timeout
 
         # Read data block
-        self.spi.readinto(buf, 0xFF)
+        self._spi_readinto(buf, 0xFF)
 
         # Read 2-byte CRC
-        self.spi.write(b"\xff")
-        self.spi.write(b"\xff")
+        self._spi_write(self._FF2)
 
         self.cs.value(1)
-        self.spi.write(b"\xff")  # Dummy clock
+        self._spi_write(self._FF1)  # Dummy clock
         return 0
 
-    def _write(self, cmd, buf, token=0xFE, arg=0):
-        if self._cmd(cmd, arg) != 0:
-            return -1
+    def _stop_transmission(self):
+        # CMD12 ends a CMD18 read stream. The byte after the command is a stuff
+        # byte, then R1, then the card may hold the bus busy.
+        self._pack_into(">BIB", self.cmdbuf, 0, 0x40 | _CMD12, 0, 0xFF)
+        self._spi_write(self.cmdbuf)
+        self._spi_readinto(self.tokenbuf, 0xFF)  # Discard stuff byte
 
-        self.cs.value(0)
+        ret = -1
+        for _ in range(_CMD_TIMEOUT):
+            self._spi_readinto(self.tokenbuf, 0xFF)
+            if not (self.tokenbuf[0] & 0x80):
+                ret = self._wait_ready()
+                break
 
+        self.cs.value(1)
+        self._spi_write(self._FF1)  # Dummy clock
+        return ret
+
+    def _send_packet(self, token, buf):
         # Send data packet
-        self.spi.write(bytearray([token]))  # Start block token
-        self.spi.write(buf)  # Data
-        self.spi.write(b"\xff\xff")  # Dummy CRC
+        self._spi_write(bytearray([token]))  # Start block token
+        self._spi_write(buf)  # Data
+        self._spi_write(self._FF2)  # Dummy CRC
 
         # Wait for response token
         for _ in range(_CMD_TIMEOUT):
-            self.spi.readinto(self.tokenbuf, 0xFF)
+            self._spi_readinto(self.tokenbuf, 0xFF)
             if self.tokenbuf[0] & 0x10 == 0:  # Check for data response token
                 break
 
         if (self.tokenbuf[0] & 0x0F) != 0x05:  # Check if data accepted
-            self.cs.value(1)
-            self.spi.write(b"\xff")
             return -1  # Data rejected
 
         # Wait for card to finish writing
-        if self._wait_ready() != 0:
-            self.cs.value(1)
-            self.spi.write(b"\xff")
-            return -1  # Timeout
+        return self._wait_ready()
+
+    def _write(self, cmd, buf, token=_TOKEN_DATA, arg=0):
+        if self._cmd(cmd, arg) != 0:
+            return -1
+
+        self.cs.value(0)
+        ret = self._send_packet(token, buf)
 
         self.cs.value(1)
-        self.spi.write(b"\xff")  # Dummy clock
-        return 0
+        self._spi_write(self._FF1)  # Dummy clock
+        return ret
 
     # --- Block Device API ---
-    def readblocks(self, block_num, buf, num_blocks=1):
+    def readblocks(self, block_num, buf):
         n = len(buf)
         if n % 512 != 0:
             raise ValueError("Buffer size must be a multiple of 512")
 
-        offset = 0
-        for i in range(num_blocks):
-            addr = block_num + i
-            if self.card_type != _CARD_TYPE_SDHC:
-                addr *= 512  # Convert to byte address for SDv1/v2
+        addr = block_num << self._addr_shift
 
-            if self._readinto(_CMD17, self.buf, addr) != 0:
-                return -1  # Error
+        if n == 512:
+            # Read the single block straight into the caller's buffer
+            return self._readinto(_CMD17, buf, addr)
 
-            buf[offset:offset + 512] = self.buf
-            offset += 512
+        # Several blocks: one CMD18, then a stream of data packets read
+        # straight into the caller's buffer, ended by CMD12
+        if self._cmd(_CMD18, addr) != 0:
+            return -1  # Error
 
-        return 0
+        self.cs.value(0)
+        mv = memoryview(buf)
+        for offset in range(0, n, 512):
+            if self._wait_token(_TOKEN_DATA) != 0:
+                self._stop_transmission()
+                return -1  # Timeout
+            self._spi_readinto(mv[offset:offset + 512], 0xFF)
+            self._spi_write(self._FF2)  # Skip CRC
 
-    def writeblocks(self, block_num, buf, num_blocks=1):
+        return self._stop_transmission()
+
+    def writeblocks(self, block_num, buf):
         n = len(buf)
         if n % 512 != 0:
             raise ValueError("Buffer size must be a multiple of 512")
 
-        offset = 0
-        for i in range(num_blocks):
-            addr = block_num + i
-            if self.card_type != _CARD_TYPE_SDHC:
-                addr *= 512  # Convert to byte address for SDv1/v2
+        addr = block_num << self._addr_shift
+
+        if n == 512:
+            # spi.write takes any buffer, so no bounce copy is needed
+            return self._write(_CMD24, buf, _TOKEN_DATA, addr)
 
-            self.buf[:] = buf[offset:offset + 512]
+        # Several blocks: one CMD25, then a data packet per block sent straight
+        # from the caller's buffer, ended by the stop-tran token
+        if self._cmd(_CMD25, addr) != 0:
+            return -1  # Error
 
-            if self._write(_CMD24, self.buf, 0xFE, addr) != 0:
-                return -1  # Error
+        self.cs.value(0)
+        mv = memoryview(buf)
+        ret = 0
+        for offset in range(0, n, 512):
+            if self._send_packet(_TOKEN_CMD25, mv[offset:offset + 512]) != 0:
+                ret = -1  # Data rejected or timeout
+                break
 
-            offset += 512
+        self._spi_write(bytearray([_TOKEN_STOP_TRAN]))
+        self._spi_readinto(self.tokenbuf, 0xFF)  # Card starts busy after one byte
+        if self._wait_ready() != 0:
+            ret = -1  # Timeout
 
-        return 0
+        self.cs.value(1)
+        self._spi_write(self._FF1)  # Dummy clock
+        return ret
+
+    def _csd_num_blocks(self):
+        # Card capacity in 512-byte blocks, decoded from the CSD
+        csd = self.csd
+        if self.card_type == _CARD_TYPE_SDHC:
+            # SDHC CSD v2.0 - 22-bit c_size, size is in 512K blocks
+            c_size = ((csd[7] & 0x3F) << 16) | (csd[8] << 8) | csd[9]
+            return (c_size + 1) << 10
+
+        # SDv1/v2 CSD v1.0 - capacity = (c_size + 1) * 2^(c_size_mult + 2) * 2^read_bl_len bytes
+        c_size = ((csd[6] & 0x03) << 10) | (csd[7] << 2) | ((csd[8] & 0xC0) >> 6)
+        c_size_mult = ((csd[9] & 0x03) << 1) | ((csd[10] & 0x80) >> 7)
+        read_bl_len = csd[5] & 0x0F
+        return (c_size + 1) << (c_size_mult + 2 + read_bl_len - 9)
 
     def ioctl(self, op, arg):
-        if op == 4:  # Get number of blocks
-            if self.csd is None:
-                return -1
-
-            c_size = ((self.csd[6] & 0x03) << 10) | (self.csd[7] << 2) | ((self.csd[8] & 0xC0) >> 6)
-
-            if self.card_type == _CARD_TYPE_SDHC:
-                # SDHC CSD v2.0 - size is in 512K blocks
-                return (c_size + 1) * 1024
-            else:
-                # SDv1/v2 CSD v1.0 - size is in blocks
-                c_size_mult = ((self.csd[9] & 0x03) << 1) | ((self.csd[10] & 0x80) >> 7)
-                read_bl_len = self.csd[5] & 0x0F
-                capacity = (c_size + 1) * (2 ** (c_size_mult + 2)) * (2 ** read_bl_len)
-                return capacity // 512  # Return number of 512-byte blocks
+        if op == 4:  # Get number of blocks (decoded once in init_card)
+            return self._num_blocks
 
         if op == 5:  # Get block size
             return 512
@@ -4,19 +4,22 @@
 import machine
 import uos
 import time
+import uasyncio as asyncio
+import _thread
 import mpu6050
 import bme280
 import micropyGPS
 import dust_sensor
 import uhashlib  # For hash chain
 import ubinascii  # For hash chain
-from machine import Pin, SoftI2C, SPI, ADC, UART
+from machine import Pin, I2C, SPI, ADC, UART
 from sdcard import SDCard
 
 # --- Config ---
 # I2C
 I2C_SCL_PIN = 22
 I2C_SDA_PIN = 21
+I2C_FREQ = 400000  # Fast mode; BME280 and MPU6050 both support it
 BME280_A_ADDR = 0x76
 BME280_B_ADDR = 0x77
 MPU6050_ADDR = 0x68
@@ -41,14 +44,46 @@ SPI_CS_PIN = 5
 SD_MOUNT_POINT = '/sd'
 
 LOG_FILE = f"{SD_MOUNT_POINT}/forensic_log_v4.csv"
+# Must match analysis.py's LOG_COLUMNS; a log with any other header is rotated out
+LOG_HEADER = b"timestamp,pressure_delta,vibration_mag_sq,audio_level,dust_raw,lat,lon,alt,prev_hash\n"
+# One row per boot: the clock baseline and where that boot's rows start in LOG_FILE
+BOOT_LOG_FILE = f"{SD_MOUNT_POINT}/forensic_log_v4_boots.csv"
 LOG_INTERVAL_MS = 100  # Log 10 times per second
+CLOCK_REBASE_MS = 3600000  # Re-anchor the timestamp baseline hourly (ticks_ms wraps after ~12 days)
+GPS_POLL_MS = 10  # Drain the GPS UART between samples
+GPS_BUF_BYTES = 128  # UART bytes drained per poll (9600 baud is ~10 bytes per 10ms)
+LOG_FLUSH_LINES = 20  # Write every 2 seconds
+LOG_REOPEN_FLUSHES = 10  # Close + reopen the log every N writes to commit FAT metadata
+LOG_TAIL_BYTES = 512  # Read back when resuming; comfortably more than one log line
+LOG_LINE_MAX = 128  # Upper bound on one log line, in bytes
+LOG_BUF_BYTES = 2 * LOG_FLUSH_LINES * LOG_LINE_MAX  # Per buffer; headroom while the writer is busy
+LOG_WRITER_POLL_MS = 5  # Writer thread's idle poll
+LOG_RETRY_MS = 1000  # Back-off before retrying a failed log write
+LOG_WRITER_STACK = 16384  # FatFS calls back into the Python SD driver on this thread
+# Hash chain links are SHA-256 truncated to 128 bits: still far beyond brute-force
+# reach for tamper evidence, and half the hex per row on the SD card
+HASH_BYTES = 16
+# Data fields of a log line (the hex hash link follows the trailing comma)
+LOG_FIELDS_FMT = b"%d,%.2f,%d,%d,%d,%.6f,%.6f,%.1f,"
 
 # --- Globals ---
 i2c = None
 bme_a, bme_b, mpu, mic_adc, sd = None, None, None, None, None
 gps_uart = None
 gps_parser = micropyGPS.MicropyGPS()
+gps_buf = bytearray(GPS_BUF_BYTES)
 dust_sensor_dev = None
+log_file = None
+log_size = 0  # Bytes of the log file committed to the card
+log_flushes = 0
+clock_base_ms = 0  # Wall-clock ms (port epoch) at clock_base_ticks
+clock_base_ticks = 0
+# Double buffer: the logger fills the active one while the writer thread saves the other
+log_bufs = (memoryview(bytearray(LOG_BUF_BYTES)), memoryview(bytearray(LOG_BUF_BYTES)))
+log_active = 0  # Index of the buffer being filled
+log_len = 0  # Bytes used in the active buffer
+log_lines = 0  # Lines in the active buffer
+flush_len = 0  # Bytes of the other buffer waiting for the writer; 0 while it is idle
 
 
 # --- Initialization ---
@@ -57,7 +92,7 @@ def init_all():
     print("Initializing components V4.0...")
 
     try:
-        i2c = SoftI2C(scl=Pin(I2C_SCL_PIN), sda=Pin(I2C_SDA_PIN))
+        i2c = I2C(0, scl=Pin(I2C_SCL_PIN), sda=Pin(I2C_SDA_PIN), freq=I2C_FREQ)  # Hardware peripheral
         mpu = mpu6050.accel(i2c, MPU6050_ADDR)
         bme_a = bme280.BME280(i2c=i2c, address=BME280_A_ADDR)
         bme_b = bme280.BME280(i2c=i2c, address=BME280_B_ADDR)
@@ -66,19 +101,22 @@ def init_all():
         dust_sensor_dev = dust_sensor.DustSensor(DUST_LED_PIN, DUST_ADC_PIN)
         gps_uart = UART(GPS_UART_NUM, 9600, tx=GPS_TX_PIN, rx=GPS_RX_PIN, timeout=10)
 
-        spi = SPI(1, 10000000, sck=Pin(SPI_SCK_PIN), mosi=Pin(SPI_MOSI_PIN), miso=Pin(SPI_MISO_PIN))
-        sd = SDCard(spi, Pin(SPI_CS_PIN))
+        spi = SPI(1, sck=Pin(SPI_SCK_PIN), mosi=Pin(SPI_MOSI_PIN), miso=Pin(SPI_MISO_PIN))
+        sd = SDCard(spi, Pin(SPI_CS_PIN))  # Sets and verifies the bus clock itself
         uos.mount(sd, SD_MOUNT_POINT)
-        print(f"SD card mounted at {SD_MOUNT_POINT}")
+        print(f"SD card mounted at {SD_MOUNT_POINT} ({sd.baudrate // 1000000} MHz)")
 
         # Check for log file
         try:
             uos.stat(LOG_FILE)
-            print("Log file found.")
         except OSError:
             print("Log file not found. Creating new one.")
-            with open(LOG_FILE, 'w') as f:
-                f.write("timestamp,pressure_delta,vibration_mag,audio_level,dust_voltage,lat,lon,alt,prev_hash\n")
+            create_log()
+        else:
+            print("Log file found.")
+            # Never append to a log written by firmware with another row format
+            if read_log_header() != LOG_HEADER:
+                rotate_log("Log header does not match this firmware")
 
         print("--- Init complete. Starting logger. ---")
         return True
@@ -89,62 +127,250 @@ def init_all():
 
 
 # --- Helper Functions ---
-def get_vibration_magnitude():
+def init_clock():
+    # Read the RTC once; every timestamp after this is an offset in ticks.
+    # Nothing sets the RTC, so after a cold boot it restarts at the port epoch
+    # (2000-01-01 on the ESP32) and timestamps are relative to that boot; see
+    # record_boot.
+    global clock_base_ms, clock_base_ticks
+    clock_base_ticks = time.ticks_ms()
+    clock_base_ms = time.time() * 1000
+    print(f"Clock baseline: {clock_base_ms} ms")
+
+
+def get_timestamp_ms():
+    # Monotonic ms timestamp: baseline plus elapsed ticks (no localtime() struct
+    # or date formatting per sample)
+    global clock_base_ms, clock_base_ticks
+    now = time.ticks_ms()
+    elapsed = time.ticks_diff(now, clock_base_ticks)
+    if elapsed >= CLOCK_REBASE_MS:  # Keep well inside ticks_diff's range
+        clock_base_ms += elapsed
+        clock_base_ticks = now
+        elapsed = 0
+    return clock_base_ms + elapsed
+
+
+def get_vibration_mag_sq():
+    # Squared gyro magnitude as an exact int; the analysis takes the square root
     try:
-        g = mpu.get_values()
-        return (g["GyX"] ** 2 + g["GyY"] ** 2 + g["GyZ"] ** 2) ** 0.5
+        gx, gy, gz = mpu.get_gyro()
+        return gx * gx + gy * gy + gz * gz  # Plain multiplies, not 3 power ops
     except Exception:
-        return 0.0
+        return 0
 
 
 def update_gps():
-    if gps_uart.any():
+    # Drain whatever has arrived into the reusable buffer (no per-line allocation);
+    # the parser reassembles sentences across polls
+    n = gps_uart.any()
+    if n:
         try:
-            line = gps_uart.readline()
-            if line: gps_parser.update(line.decode('utf-8'))
+            n = gps_uart.readinto(gps_buf, min(n, GPS_BUF_BYTES))
+            if n: gps_parser.feed(gps_buf, n)
         except Exception:
             pass
 
 
-def get_hash(data_string):
-    sha = uhashlib.sha256(data_string.encode('utf-8'))
-    return ubinascii.hexlify(sha.digest()).decode('utf-8')
+async def gps_task():
+    # Runs whenever the logger awaits (e.g. during the dust sensor's quiet window)
+    while True:
+        update_gps()
+        await asyncio.sleep_ms(GPS_POLL_MS)
 
 
-def get_last_line(filepath):
+def chain_digest(fields, prev_digest):
+    # A link hashes the row's data fields plus the previous link's raw digest
+    # (half the bytes of its hex form, so usually one SHA-256 block less)
+    sha = uhashlib.sha256(fields)
+    sha.update(prev_digest)
+    return sha.digest()[:HASH_BYTES]
+
+
+def create_log():
+    with open(LOG_FILE, 'wb') as f:
+        f.write(LOG_HEADER)
+
+
+def read_log_header():
+    with open(LOG_FILE, 'rb') as f:
+        return f.readline()
+
+
+def record_boot():
+    # Appends this boot's clock baseline and the log offset its rows start at to
+    # BOOT_LOG_FILE, so timestamps that restart on each power cycle can be
+    # placed in order offline. Not part of the hash chain.
     try:
-        with open(filepath, 'r') as f:
-            lines = f.readlines()
-            if len(lines) > 1:
-                return lines[-1].strip()  # Get the last line
-            else:
-                return None  # Only header exists
+        try:
+            uos.stat(BOOT_LOG_FILE)
+            header = ""
+        except OSError:
+            header = "boot_clock_ms,log_offset\n"
+        with open(BOOT_LOG_FILE, 'a') as f:
+            f.write(f"{header}{clock_base_ms},{log_size}\n")
     except Exception as e:
-        print(f"Error reading last line: {e}")
-        return None
+        print(f"Error recording boot: {e}")
+
+
+def rotate_log(reason):
+    # Keeps the current log as forensic_log_v4.<n>.csv (never overwritten) and
+    # starts a fresh one, so the caller must start a new chain from genesis
+    n = 1
+    while True:
+        archived = f"{SD_MOUNT_POINT}/forensic_log_v4.{n}.csv"
+        try:
+            uos.stat(archived)
+            n += 1
+        except OSError:
+            break
+    uos.rename(LOG_FILE, archived)
+    try:
+        uos.rename(BOOT_LOG_FILE, archived[:-4] + "_boots.csv")  # Its offsets belong to the old log
+    except OSError:
+        pass  # No boots recorded yet
+    print(f"{reason}: moved it to {archived}, starting a new log.")
+    create_log()
+
+
+def open_log():
+    global log_file, log_size
+    size = uos.stat(LOG_FILE)[6]
+    log_file = open(LOG_FILE, 'ab')
+    log_size = size
+
+
+def reopen_log():
+    # After a failed write: reopen the log, re-reading how much is on the card
+    try:
+        log_file.close()
+    except Exception:
+        pass
+    try:
+        open_log()
+    except Exception as e:
+        print(f"Log reopen error: {e}")
+
+
+def write_log(data):
+    # One FatFS write per flush through a handle kept open between flushes
+    global log_size, log_flushes
+    log_file.write(data)
+    log_file.flush()
+    log_size += len(data)
+    log_flushes += 1
+    if log_flushes % LOG_REOPEN_FLUSHES == 0:
+        log_file.close()
+        open_log()
+
+
+def log_writer():
+    # Runs on its own thread, so SD write stalls (a block erase can take tens
+    # of ms) never delay a sample. Only this thread touches log_file once started.
+    # A failed write keeps the buffer and is retried after reopening the file,
+    # carrying on after whatever part already reached the card, so no chained
+    # line is dropped or written twice.
+    global flush_len
+    start = -1  # log_size when the pending buffer's first write began
+    while True:
+        if not flush_len:
+            time.sleep_ms(LOG_WRITER_POLL_MS)
+            continue
+        if start < 0:
+            start = log_size
+        done = min(max(log_size - start, 0), flush_len)
+        try:
+            write_log(log_bufs[1 - log_active][done:flush_len])
+        except Exception as e:
+            print(f"Log write error (retrying): {e}")
+            time.sleep_ms(LOG_RETRY_MS)
+            reopen_log()
+            continue
+        start = -1
+        flush_len = 0  # Hand the buffer back only once it is on the card
+
+
+def append_log(fields, link):
+    # Copies one line into the active buffer in place (no per-line list or join)
+    global log_len, log_lines
+    buf = log_bufs[log_active]
+    end = log_len + len(fields)
+    buf[log_len:end] = fields
+    buf[end:end + len(link)] = link
+    end += len(link)
+    buf[end] = 0x0A  # '\n'
+    log_len = end + 1
+    log_lines += 1
+
+
+def start_flush():
+    # Hands the active buffer to the writer thread and switches to the other one.
+    # Returns False if the writer is still busy with the previous buffer.
+    global log_active, log_len, log_lines, flush_len
+    if flush_len or not log_len:
+        return False
+    log_active = 1 - log_active  # Before flush_len: the writer reads log_active once it sees work
+    n = log_len
+    log_len, log_lines = 0, 0
+    flush_len = n
+    return True
+
+
+def get_last_line(filepath):
+    # Reads only the file's tail (one SD block), not the whole log.
+    # Read errors propagate: the caller must not restart the chain mid-file.
+    with open(filepath, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        read_len = min(LOG_TAIL_BYTES, size)
+        f.seek(size - read_len)
+        tail = f.read(read_len)
+    idx = tail.rfind(b"\n", 0, -1)
+    if idx < 0:
+        return None  # Only header exists
+    return tail[idx + 1:].strip()  # Get the last line
+
+
+def resume_digest(last_line):
+    # The link the next row must store, from the log's last line
+    split = last_line.rindex(b',') + 1  # Data fields | stored hex link
+    stored = ubinascii.unhexlify(last_line[split:])
+    if len(stored) != HASH_BYTES:
+        raise ValueError("bad hash link")
+    return chain_digest(last_line[:split], stored)
 
 
 # --- Main Loop ---
-def run_logger():
+async def run_logger():
     if not init_all(): return
 
     last_log_time = 0
+    init_clock()
 
     # Get hash of the last line to start the chain
-    last_line = get_last_line(LOG_FILE)
-    if last_line:
-        prev_hash = get_hash(last_line)
-        print(f"Resuming hash chain from: {prev_hash}")
-    else:
-        prev_hash = "0" * 64  # Genesis hash
+    try:
+        last_line = get_last_line(LOG_FILE)
+        if last_line:
+            prev_digest = resume_digest(last_line)
+            print(f"Resuming hash chain from: {ubinascii.hexlify(prev_digest).decode('utf-8')}")
+    except Exception as e:
+        # Unreadable, truncated or hand-edited last line: keep that file as it
+        # is and start a new one instead of refusing to log on every boot
+        rotate_log(f"Can't resume the hash chain ({e})")
+        last_line = None
+    if not last_line:
+        prev_digest = bytes(HASH_BYTES)  # Genesis hash (all zeros)
         print("Starting new log with genesis hash.")
 
-    log_buffer = []
+    open_log()
+    record_boot()
+    _thread.stack_size(LOG_WRITER_STACK)
+    _thread.start_new_thread(log_writer, ())
+    asyncio.create_task(gps_task())  # Continuously poll GPS
 
     while True:
         try:
             current_time = time.ticks_ms()
-            update_gps()  # Continuously poll GPS
 
             if time.ticks_diff(current_time, last_log_time) >= LOG_INTERVAL_MS:
                 last_log_time = current_time
@@ -152,39 +378,37 @@ def run_logger():
                 # --- 1. Get Sensor Snapshots ---
                 timestamp = get_timestamp_ms()
                 delta_p = bme_a.pressure - bme_b.pressure
-                vib_mag = get_vibration_magnitude()
+                vib_sq = get_vibration_mag_sq()
                 audio_level = mic_adc.read()
-                dust_v = dust_sensor_dev.read_voltage()  # This takes 10ms
+                dust_raw = await dust_sensor_dev.read_raw()  # This takes 10ms (GPS runs meanwhile)
 
                 lat, lon, alt = 0.0, 0.0, 0.0
                 if gps_parser.fix_stat > 0:
                     lat, lon, alt = gps_parser.latitude, gps_parser.longitude, gps_parser.altitude
 
                 # --- 2. Create Log Line & Hash ---
-                log_line = f"{timestamp},{delta_p:.2f},{vib_mag:.2f},{audio_level},{dust_v:.3f},{lat:.6f},{lon:.6f},{alt:.1f},{prev_hash}"
+                fields = LOG_FIELDS_FMT % (timestamp, delta_p, vib_sq, audio_level, dust_raw, lat, lon, alt)
+                # Buffer full and the writer still busy: wait for it (never drop a line)
+                while log_len + LOG_LINE_MAX > LOG_BUF_BYTES and not start_flush():
+                    await asyncio.sleep_ms(1)
+                # The CSV stores the link as hex; the chain itself uses the raw digest
+                append_log(fields, ubinascii.hexlify(prev_digest))
 
                 # Update the hash for the *next* iteration
-                prev_hash = get_hash(log_line)
+                prev_digest = chain_digest(fields, prev_digest)
 
-                log_buffer.append(log_line + "\n")
-
-                # --- 3. Write to SD Card ---
-                if len(log_buffer) >= 20:  # Write every 2 seconds
-                    with open(LOG_FILE, 'a') as f:
-                        for line in log_buffer:
-                            f.write(line)
-                    log_buffer = []
+                # --- 3. Hand off to the SD writer thread ---
+                if log_lines >= LOG_FLUSH_LINES and start_flush():
                     print(
-                        f"LOG: dP:{delta_p:.0f} Vb:{vib_mag:.0f} Au:{audio_level} Du:{dust_v:.2f} GPS:{gps_parser.fix_stat}")
+                        f"LOG: dP:{delta_p:.0f} Vb2:{vib_sq} Au:{audio_level} Du:{dust_raw} GPS:{gps_parser.fix_stat}")
+
+            await asyncio.sleep_ms(1)  # Yield to the GPS task between samples
 
         except Exception as e:
             print(f"Main loop error: {e}")
-            if log_buffer:
-                with open(LOG_FILE, 'a') as f:
-                    for line in log_buffer:
-                        f.write(line)
-            time.sleep(1)
+            start_flush()
+            await asyncio.sleep(1)
 
 
 # Run the logger
-run_logger()
+asyncio.run(run_logger())
@@ -0,0 +1,17 @@
+# manifest.py
+# Freezes the logger and its drivers into the MicroPython image as bytecode:
+# nothing is compiled from the SD/flash filesystem at boot, and const() values
+# are inlined. Build from a MicroPython checkout (ports/esp32):
+#   make BOARD=ESP32_GENERIC FROZEN_MANIFEST=/path/to/firmware/manifest.py
+
+# Keep the port's default frozen modules (uasyncio etc.)
+include("$(PORT_DIR)/boards/manifest.py")
+
+# A frozen main.py runs at boot just like one on the filesystem
+module("main.py")
+
+module("sdcard.py", base_path="lib")
+module("bme280.py", base_path="lib")
+module("mpu6050.py", base_path="lib")
+module("micropyGPS.py", base_path="lib")
+module("dust_sensor.py", base_path="lib")